@@ -1,7 +1,14 @@
 import argparse
 import logging
+import os
 import pathlib
 
+_HOME = pathlib.Path.home()
+# built once at import and shared by every subparser
+_DEFAULT_CONFIG = _HOME / ".config/local-repo-manager/config.toml"
+_DEFAULT_REPO_DIR = _HOME / "dev"
+_DEFAULT_JOBS = min(os.cpu_count() or 1, 8)
+
 
 def setup_parser() -> argparse.ArgumentParser:
     cmd_parser = argparse.ArgumentParser(
@@ -25,6 +32,18 @@ def setup_parser() -> argparse.ArgumentParser:
         help="skip fetching remotes",
         action="store_true",
     )
+    apply_parser.add_argument(
+        "--clone-jobs",
+        help="number of repos to clone in parallel (default: 4)",
+        type=positive_int,
+        default=4,
+    )
+    apply_parser.add_argument(
+        "--submodule-jobs",
+        help="number of submodules to fetch in parallel (default: 4)",
+        type=positive_int,
+        default=4,
+    )
     add_common_args(apply_parser)
 
     update = subparser.add_parser(
@@ -35,18 +54,31 @@ def setup_parser() -> argparse.ArgumentParser:
     return cmd_parser
 
 
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
 def add_common_args(subparser: argparse.ArgumentParser):
     subparser.add_argument(
         "--config-file",
         help="path to config file (default: ~/.config/local-repo-manager/config.toml)",
         type=pathlib.Path,
-        default=pathlib.Path.home() / ".config/local-repo-manager/config.toml",
+        default=_DEFAULT_CONFIG,
     )
     subparser.add_argument(
         "--repo-dir",
         help="path to parent directory of git repos (default: ~/dev)",
         type=pathlib.Path,
-        default=pathlib.Path.home() / "dev",
+        default=_DEFAULT_REPO_DIR,
+    )
+    subparser.add_argument(
+        "--jobs",
+        help="number of projects to process in parallel (default: min(cpu count, 8))",
+        type=positive_int,
+        default=_DEFAULT_JOBS,
     )
     subparser.add_argument(
         "--verbose",
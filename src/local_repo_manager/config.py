@@ -1,40 +1,97 @@
+import copy
+import functools
+import hashlib
+import json
+import logging
 import os
 import pathlib
+import tomllib
+from collections.abc import Mapping
 from typing import Any
 
 import tomlkit
 
+from . import util
+from .errors import LRMError
 
-def load_config(config_path: pathlib.Path) -> tomlkit.TOMLDocument | None:
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache
+def _parse_config(path: str, mtime_ns: int, size: int) -> dict[str, Any]:
+    """Parse a config file, cached until the file changes."""
+    key = [mtime_ns, size]
+    cache_path = _get_cache_path(path)
+    try:
+        cached = json.loads(cache_path.read_bytes())
+        if cached["key"] == key:
+            logger.debug("using cached config %r", str(cache_path))
+            return cached["config"]
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.debug("no usable cached config for %r", path)
+
+    config = tomllib.loads(pathlib.Path(path).read_text())
+    _write_cache(cache_path, {"key": key, "config": config})
+    return config
+
+
+def _get_cache_path(path: str) -> pathlib.Path:
+    digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+    return util.CACHE_DIR / f"config.{digest}.json"
+
+
+def _write_cache(cache_path: pathlib.Path, data: dict[str, Any]) -> None:
+    try:
+        content = json.dumps(data)
+    # the config has values that can't be stored as json, such as dates
+    except TypeError:
+        logger.debug("can't cache config as json")
+        return
+
+    # write to a temporary file and rename it so readers never see a partial file
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(content)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.debug("failed to cache config: %s", e)
+
+
+def load_config(config_path: pathlib.Path) -> dict[str, Any] | None:
     """Read a local file named config.toml and parse it as a dict."""
+    try:
+        stat = config_path.stat()
+        # copy so callers can't modify the cached config
+        return copy.deepcopy(
+            _parse_config(str(config_path), stat.st_mtime_ns, stat.st_size)
+        )
+    except FileNotFoundError:
+        print("Warning: Config file not found.")
+    except Exception as e:
+        raise LRMError(os.EX_DATAERR, f"error reading config file: {e}") from e
+
+
+def load_config_document(config_path: pathlib.Path) -> tomlkit.TOMLDocument | None:
+    """Read the config file as a document that keeps its comments and formatting."""
     try:
         return tomlkit.parse(config_path.read_text())
     except FileNotFoundError:
         print("Warning: Config file not found.")
     except Exception as e:
-        print(f"Error reading config file: {e}")
-        exit(os.EX_DATAERR)
+        raise LRMError(os.EX_DATAERR, f"error reading config file: {e}") from e
 
 
-def get_projects(config: tomlkit.TOMLDocument):
+def get_projects(config: Mapping[str, Any]):
     projects: dict[str, Any] = config.get("project")
     if not projects:
-        print("No projects found in config.")
-        exit(os.EX_DATAERR)
+        raise LRMError(os.EX_DATAERR, "no projects found in config")
     return projects
 
 
 def get_repo_dir(
-    config: tomlkit.TOMLDocument | None, arg_repo_dir: pathlib.Path
+    config: Mapping[str, Any] | None, arg_repo_dir: pathlib.Path
 ) -> pathlib.Path:
-    if config:
-        repo_dir_table = config.get("repo-dir")
-        if repo_dir_table:
-            repo_dir = pathlib.Path(repo_dir_table.get("repo-dir"))
-        else:
-            repo_dir = arg_repo_dir
-    else:
-        repo_dir = arg_repo_dir
-
-    repo_dir.resolve()
-    return repo_dir
+    if config and config.get("repo-dir"):
+        return pathlib.Path(config["repo-dir"]["repo-dir"]).expanduser()
+    return arg_repo_dir.expanduser()
@@ -1,28 +1,99 @@
+import functools
+import hashlib
 import logging
+import os
 import pathlib
 
 from . import util
 
 logger = logging.getLogger(__name__)
 
+MAX_ENVRC_SIZE = 1 << 16
+DIRENV_ALLOWED_STATUSES = ("Found RC allowed true", "Found RC allowed 0")
+
 
 def has_envrc(directory: pathlib.Path) -> bool:
     """True if the repo has a .envrc file for activating a venv."""
     envrc_path = directory / ".envrc"
-    if envrc_path.exists():
-        logger.debug("  found .envrc file in %r", str(directory))
-        content = envrc_path.read_text()
-        if "source .venv/bin/activate" in content:
-            logger.debug("  found venv .envrc file in %r", str(directory))
-            return True
+    try:
+        stat = envrc_path.stat()
+    except FileNotFoundError:
+        return False
+
+    if stat.st_size > MAX_ENVRC_SIZE:
+        logger.debug("  .envrc file is too large to inspect (%d bytes)", stat.st_size)
+        return False
+    if _sources_venv(str(envrc_path), stat.st_mtime_ns, stat.st_size):
+        logger.debug("  found venv .envrc file in %r", str(directory))
+        return True
     return False
 
 
+@functools.lru_cache
+def _sources_venv(envrc_path: str, mtime_ns: int, size: int) -> bool:
+    """True if an .envrc activates the venv, cached until the file changes."""
+    # search the raw bytes to skip decoding the file
+    return b"source .venv/bin/activate" in pathlib.Path(envrc_path).read_bytes()
+
+
+def get_allow_path(directory: pathlib.Path) -> pathlib.Path:
+    """Get the file direnv creates when a directory's .envrc is allowed."""
+    envrc_path = os.path.abspath(directory / ".envrc")
+    stat = os.stat(envrc_path)
+    digest = _hash_envrc(envrc_path, stat.st_mtime_ns, stat.st_size)
+    return _get_direnv_dir() / "allow" / digest
+
+
+def get_deny_path(directory: pathlib.Path) -> pathlib.Path:
+    """Get the file direnv creates when a directory's .envrc is denied."""
+    envrc_path = os.path.abspath(directory / ".envrc")
+    # unlike allow files, deny files only hash the path
+    digest = hashlib.sha256(f"{envrc_path}\n".encode()).hexdigest()
+    return _get_direnv_dir() / "deny" / digest
+
+
+def _get_direnv_dir() -> pathlib.Path:
+    data_dir = os.environ.get("XDG_DATA_HOME") or pathlib.Path.home() / ".local/share"
+    return pathlib.Path(data_dir) / "direnv"
+
+
+@functools.lru_cache
+def _hash_envrc(envrc_path: str, mtime_ns: int, size: int) -> str:
+    """Hash an .envrc's path and contents like direnv, cached until the file changes."""
+    digest = hashlib.sha256(f"{envrc_path}\n".encode())
+    digest.update(pathlib.Path(envrc_path).read_bytes())
+    return digest.hexdigest()
+
+
 def is_envrc_setup(directory: pathlib.Path) -> bool:
-    output = util.run_command(["direnv", "status"], cwd=directory)
-    if "Found RC allowed true" in output:
+    allow_path = get_allow_path(directory)
+    if allow_path.parent.is_dir():
+        # direnv checks for a deny file before the allow file
+        allowed = allow_path.exists() and not get_deny_path(directory).exists()
+    else:
+        # direnv keeps its data somewhere else, so ask direnv itself
+        logger.debug("  direnv allow dir %r not found", str(allow_path.parent))
+        output = util.run_command(["direnv", "status"], cwd=directory)
+        # newer direnv versions report the allow status as a number
+        allowed = any(status in output for status in DIRENV_ALLOWED_STATUSES)
+
+    if allowed:
         logger.debug("  .envrc is allowed")
         return True
 
     logger.debug("  .envrc is not allowed")
     return False
+
+
+def allow_envrc(directory: pathlib.Path) -> None:
+    """Allow a directory's .envrc the same way 'direnv allow' does."""
+    allow_path = get_allow_path(directory)
+    if not allow_path.parent.is_dir():
+        util.run_command(["direnv", "allow", str(directory)], capture=False)
+        return
+
+    deny_path = get_deny_path(directory)
+    logger.debug("  removing direnv deny file %r", str(deny_path))
+    deny_path.unlink(missing_ok=True)
+    logger.debug("  creating direnv allow file %r", str(allow_path))
+    allow_path.write_text(f"{os.path.abspath(directory / '.envrc')}\n")
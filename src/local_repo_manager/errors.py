@@ -0,0 +1,6 @@
+class LRMError(Exception):
+    """An error that stops local-repo-manager with an exit code."""
+
+    def __init__(self, exit_code: int, message: str):
+        super().__init__(message)
+        self.exit_code = exit_code
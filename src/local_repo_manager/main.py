@@ -1,11 +1,16 @@
+import argparse
+import concurrent.futures
 import logging
 import os
 import pathlib
+import sys
 from typing import Any
 
 from rich import print as rprint
+from rich.markup import escape
 
-from . import cli, config, project, update
+from . import cli, config, project, update, util
+from .errors import LRMError
 
 logger = logging.getLogger(__name__)
 
@@ -15,44 +20,97 @@ def run(
     repo_dir: pathlib.Path,
     action: str,
     skip_fetch: bool = False,
+    jobs: int = 1,
+    clone_jobs: int = 4,
+    submodule_jobs: int = 4,
 ):
-    for name, prj in projects.items():
-        prj = project.Project(prj, repo_dir, action, skip_fetch)
-        if action == "apply":
-            rprint(f"[bold underline]Applying plan for {name}:[/bold underline]")
-        plan = prj.run()
-        if action == "plan" and plan:
-            rprint(f"[bold yellow]🚧 Plan for {name}:[/bold yellow]")
-            for item in plan:
-                rprint(item)
-        else:
-            rprint(f"[bold green]✅ no changes to {name}[/bold green]")
+    prjs = {
+        name: project.Project(prj, repo_dir, action, skip_fetch, submodule_jobs)
+        for name, prj in projects.items()
+    }
+    if not prjs:
+        return
+    if action == "apply":
+        clone_missing(list(prjs.values()), clone_jobs)
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(jobs, len(prjs))
+    ) as executor:
+        futures = {name: executor.submit(prj.run) for name, prj in prjs.items()}
+        try:
+            # print in config order, each project as soon as it and the ones
+            # before it are done
+            for name, future in futures.items():
+                print_project(name, prjs[name], action, future.result())
+        except BaseException:
+            # don't start the remaining projects after one has failed
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def clone_missing(prjs: list[project.Project], clone_jobs: int):
+    """Clone all missing repos up front, with their own limit on parallel clones."""
+    missing = [prj for prj in prjs if not util.dir_exists(prj.dir)]
+    if not missing:
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(clone_jobs, len(missing))
+    ) as executor:
+        # consume the results so a failed clone is raised here
+        list(executor.map(project.Project.clone, missing))
+
+
+def print_project(name: str, prj: project.Project, action: str, plan: list[str]):
+    if action == "apply":
+        rprint(f"[bold underline]Applying plan for {name}:[/bold underline]")
+        if prj.output:
+            print("\n".join(prj.output))
+    if action == "plan" and plan:
+        rprint(f"[bold yellow]🚧 Plan for {name}:[/bold yellow]")
+        print("\n".join(plan))
+    else:
+        rprint(f"[bold green]✅ no changes to {name}[/bold green]")
 
 
 def main():
     parser = cli.setup_parser()
     args = parser.parse_args()
     cli.setup_logging(verbose=args.verbose)
-    cfg = config.load_config(config_path=args.config_file)
+    try:
+        run_command(parser, args)
+    except LRMError as e:
+        rprint(f"[bold red]  ❌ {escape(str(e))}[/bold red]")
+        sys.exit(e.exit_code)
+
+
+def run_command(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.command == "update":
+        # update writes the config back, so keep its comments and formatting
+        cfg = config.load_config_document(config_path=args.config_file)
+    else:
+        cfg = config.load_config(config_path=args.config_file)
     repo_dir = config.get_repo_dir(cfg, args.repo_dir)
 
     if args.command == "update":
-        new_config = update.update_config(config=cfg, repo_dir=repo_dir)
+        new_config = update.update_config(config=cfg, repo_dir=repo_dir, jobs=args.jobs)
         update.write_config_file(config=new_config, config_path=args.config_file)
     elif args.command in ["plan", "apply"]:
         if not cfg:
-            rprint("[bold red]  ❌ no config found[/bold red]")
-            exit(os.EX_DATAERR)
+            raise LRMError(os.EX_DATAERR, "no config found")
         projects = config.get_projects(cfg)
         run(
             projects=projects,
             repo_dir=repo_dir,
             action=args.command,
             skip_fetch=getattr(args, "skip_fetch", True),
+            jobs=args.jobs,
+            clone_jobs=getattr(args, "clone_jobs", 4),
+            submodule_jobs=getattr(args, "submodule_jobs", 4),
         )
     else:
         parser.print_help()
-        exit(os.EX_USAGE)
+        sys.exit(os.EX_USAGE)
 
 
 if __name__ == "__main__":
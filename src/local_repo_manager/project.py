@@ -1,14 +1,49 @@
+import functools
 import logging
+import os
 import pathlib
-import subprocess
-
-from rich import print as rprint
+import sys
 
 from . import envrc, util
+from .errors import LRMError
 
 logger = logging.getLogger(__name__)
 
 
+def _style(code: str) -> str:
+    if sys.stdout.isatty() and "NO_COLOR" not in os.environ:
+        return f"\x1b[{code}m"
+    return ""
+
+
+# pre-rendered styles, so per-line output doesn't go through rich's markup parser
+BOLD_GREEN = _style("1;32")
+ITALIC_GREEN = _style("3;32")
+BOLD_YELLOW = _style("1;33")
+ITALIC_YELLOW = _style("3;33")
+RESET = _style("0")
+
+
+def _map_refspecs(ref: str, refspecs: list[str]) -> str | None:
+    """Get the local ref a fetch with these refspecs stores a remote ref in."""
+    for refspec in refspecs:
+        source, _, destination = refspec.removeprefix("+").partition(":")
+        if not destination:
+            continue
+        if "*" in source:
+            prefix, _, suffix = source.partition("*")
+            if (
+                ref.startswith(prefix)
+                and ref.endswith(suffix)
+                and len(ref) >= len(prefix) + len(suffix)
+            ):
+                match = ref[len(prefix) : len(ref) - len(suffix)]
+                return destination.replace("*", match, 1)
+        elif ref == source:
+            return destination
+    return None
+
+
 class Project:
     def __init__(
         self,
@@ -16,38 +51,49 @@ class Project:
         repo_dir: pathlib.Path,
         action: str,
         skip_fetch: bool = False,
+        submodule_jobs: int = 4,
     ):
         self.name: str = data["name"]
         self.group: str = data["group"]
         self.envrc: bool = data.get("envrc", False)
         self.remotes: dict[str, str] = data.get("remotes", {})
-        self.dir: pathlib.Path = (repo_dir / self.group / self.name).resolve()
+        self.partial: bool = data.get("partial", False)
+        self.depth: int | None = data.get("depth")
+        # abspath is pure string handling, unlike resolve() which stats every part
+        self.dir: pathlib.Path = pathlib.Path(
+            os.path.abspath(repo_dir / self.group / self.name)
+        )
+        # prefix for git commands run in the repo, built once per project
+        self.git: tuple[str, ...] = ("git", "-C", str(self.dir))
         self.skip_fetch: bool = skip_fetch
+        self.submodule_jobs: int = submodule_jobs
+        self.just_cloned: bool = False
         self.apply: bool = action == "apply"
         self.plan = []
+        self.output = []
 
     def run(self) -> list[str]:
         logger.debug("  inspecting %r", str(self.dir))
-        if not util.dir_exists(self.dir):
+        # an initialized repo is the common case and only needs a single stat
+        if util.is_inited(self.dir):
+            logger.debug("  Repo is initialized: %s", self.dir)
+        elif not util.dir_exists(self.dir):
             if self.apply:
-                util.create_parent_dir(self.dir)
-                self.clone_repo()
+                self.clone()
             else:
                 self.plan.append(
-                    f"[bold yellow]   will clone {self.name!r} in a new directory[/bold yellow]"
+                    f"{BOLD_YELLOW}   will clone {self.name!r} in a new directory{RESET}"
                 )
                 return self.plan
-        logger.debug("  Directory exists: %s", self.dir)
-
-        if not util.is_inited(self.dir):
+        else:
+            logger.debug("  Directory exists: %s", self.dir)
             if self.apply:
                 self.init_repo()
             else:
                 self.plan.append(
-                    f"[bold yellow]   will clone {self.name!r} in an existing dir[/bold yellow]"
+                    f"{BOLD_YELLOW}   will clone {self.name!r} in an existing dir{RESET}"
                 )
                 return self.plan
-        logger.debug("  Repo is initialized: %s", util.is_inited(self.dir))
 
         if self.envrc:
             self.setup_envrc()
@@ -64,12 +110,12 @@ class Project:
         envrc_file = self.dir / ".envrc"
         if not envrc_file.exists():
             if self.apply:
-                print("  ⌛ creating .envrc")
+                self.output.append("  ⌛ creating .envrc")
                 envrc_file.write_text("source .venv/bin/activate")
-                rprint("[bold green]  ✅ created .envrc[/bold green]")
+                self.output.append(f"{BOLD_GREEN}  ✅ created .envrc{RESET}")
             else:
                 self.plan.append(
-                    f"[bold yellow]   will create .envrc in {self.name!r}[/bold yellow]"
+                    f"{BOLD_YELLOW}   will create .envrc in {self.name!r}{RESET}"
                 )
                 return
 
@@ -77,58 +123,125 @@ class Project:
             logger.debug("  .envrc is already set up")
         else:
             if self.apply:
-                print("  ⌛ allowing .envrc")
-                util.run_command(["direnv", "allow", str(self.dir)])
-                rprint("[bold green]  ✅ allowed .envrc[/bold green]")
+                self.output.append("  ⌛ allowing .envrc")
+                envrc.allow_envrc(self.dir)
+                self.output.append(f"{BOLD_GREEN}  ✅ allowed .envrc{RESET}")
             else:
                 self.plan.append(
-                    f"[bold yellow]   will allow .envrc in {self.name!r}[/bold yellow]"
+                    f"{BOLD_YELLOW}   will allow .envrc in {self.name!r}{RESET}"
                 )
 
     def setup_venv(self) -> None:
         venv_dir = self.dir / ".venv"
-        if not venv_dir.exists():
-            if self.apply:
-                print("  ⌛ creating venv")
-                util.run_command(["uv", "venv", ".venv"], cwd=self.dir)
-                rprint("[bold green]  ✅ created venv[/bold green]")
+        # projects are run in parallel, so don't let two of them race on one venv
+        with util.path_lock(venv_dir):
+            if not venv_dir.exists():
+                if self.apply:
+                    self.output.append("  ⌛ creating venv")
+                    util.run_command(
+                        ["uv", "venv", ".venv"], cwd=self.dir, capture=False
+                    )
+                    self.output.append(f"{BOLD_GREEN}  ✅ created venv{RESET}")
+                else:
+                    self.plan.append(
+                        f"{BOLD_YELLOW}   will create venv in {self.name!r}{RESET}"
+                    )
             else:
-                self.plan.append(
-                    f"[bold yellow]   will create venv in {self.name!r}[/bold yellow]"
-                )
-        else:
-            logger.debug("  venv already exists: %s", str(venv_dir))
+                logger.debug("  venv already exists: %s", str(venv_dir))
 
     def setup_origin(self):
         if "origin" in self.remotes:
-            print("  ⌛ fetching origin")
-            util.run_command(["git", "-C", str(self.dir), "fetch", "origin"])
-            rprint("[bold green]  ✅ fetched origin[/bold green]")
-            print("  ⌛ updating submodules")
-            util.run_command(
-                [
-                    "git",
-                    "-C",
-                    str(self.dir),
-                    "submodule",
-                    "update",
-                    "--init",
-                    "--recursive",
-                ]
-            )
-            rprint("[bold green]  ✅ updated submodules[/bold green]")
+            # fetching and updating submodules run in one shell
+            commands = []
+            # a fresh clone already has everything origin has
+            fetch = not self.just_cloned and self.origin_refs_changed()
+            if fetch:
+                self.output.append("  ⌛ fetching origin")
+                commands.append([*self.git, "fetch", "origin"])
+            else:
+                logger.debug("  all of origin's branches are already fetched")
+                self.output.append(f"{BOLD_GREEN}  ✅ origin is up to date{RESET}")
+
+            update_submodules = self.submodules_outdated()
+            if update_submodules:
+                self.output.append("  ⌛ updating submodules")
+                commands.append(
+                    [
+                        *self.git,
+                        "submodule",
+                        "update",
+                        "--init",
+                        "--recursive",
+                        f"--jobs={self.submodule_jobs}",
+                    ]
+                )
+            else:
+                logger.debug("  submodules are up to date")
+
+            if commands:
+                util.run_shell(commands, capture=False)
+            if fetch:
+                self.output.append(f"{BOLD_GREEN}  ✅ fetched origin{RESET}")
+            if update_submodules:
+                self.output.append(f"{BOLD_GREEN}  ✅ updated submodules{RESET}")
         else:
             logger.debug("  No origin remote found, skipping fetch")
 
+    def origin_refs_changed(self) -> bool:
+        """True if origin has a branch the repo's tracking refs don't match."""
+        remote_refs = util.run_command([*self.git, "ls-remote", "--heads", "origin"])
+        local_refs = {}
+        for line in util.run_command(
+            [
+                *self.git,
+                "for-each-ref",
+                "--format=%(refname) %(objectname)",
+                "refs/remotes/origin",
+            ]
+        ).splitlines():
+            ref, _, sha = line.partition(" ")
+            local_refs[ref] = sha
+
+        refspecs = self.get_origin_refspecs()
+        for line in remote_refs.splitlines():
+            sha, _, ref = line.partition("\t")
+            tracking_ref = _map_refspecs(ref, refspecs)
+            # branches the fetch refspecs leave out, like on single-branch
+            # clones, won't be fetched anyway
+            if tracking_ref and local_refs.get(tracking_ref) != sha:
+                logger.debug("  %s is not fetched yet", ref)
+                return True
+        return False
+
+    def get_origin_refspecs(self) -> list[str]:
+        try:
+            output = util.run_command(
+                [*self.git, "config", "--get-all", "remote.origin.fetch"]
+            )
+        except LRMError:
+            # no fetch refspecs, so a fetch won't update any branches
+            return []
+        return output.splitlines()
+
+    def submodules_outdated(self) -> bool:
+        """True if any submodule is uninitialized, out of date, or conflicted."""
+        status = util.run_command([*self.git, "submodule", "status", "--recursive"])
+        return any(line.startswith(("-", "+", "U")) for line in status.splitlines())
+
+    @functools.cached_property
+    def remote_urls(self) -> dict[str, str]:
+        """Urls of the repo's remotes, read once and kept in sync with changes."""
+        return util.list_remotes(self.dir)
+
     def set_up_remote(self, name: str, url: str) -> None:
-        actual_url = self.get_remote_url(name)
+        actual_url = self.remote_urls.get(name)
 
         if actual_url is None:
             if self.apply:
                 self.add_remote(name, url)
             else:
                 self.plan.append(
-                    f"[bold yellow]   will add remote {name!r} at {url}[/bold yellow]"
+                    f"{BOLD_YELLOW}   will add remote {name!r} at {url}{RESET}"
                 )
         elif actual_url == url:
             logger.debug("  Url %s is correct for %s", url, name)
@@ -137,44 +250,57 @@ class Project:
                 self.update_remote(name, actual_url, url)
             else:
                 self.plan.append(
-                    f"[bold yellow]   will update url for existing remote {name!r}[/bold yellow]"
-                )
-                self.plan.append(
-                    f"[yellow italic]    from {actual_url} [/yellow italic]"
+                    f"{BOLD_YELLOW}   will update url for existing remote {name!r}{RESET}"
                 )
-                self.plan.append(f"[yellow italic]    to   {url}[/yellow italic]")
+                self.plan.append(f"{ITALIC_YELLOW}    from {actual_url} {RESET}")
+                self.plan.append(f"{ITALIC_YELLOW}    to   {url}{RESET}")
 
     def add_remote(self, name: str, url: str):
-        print(f"  ⌛ adding remote {self.name!r}")
-        util.run_command(["git", "-C", str(self.dir), "remote", "add", name, url])
-        rprint(f"[bold green]  ✅ added remote {name!r}[/bold green]")
+        self.output.append(f"  ⌛ adding remote {self.name!r}")
+        util.run_command([*self.git, "remote", "add", name, url], capture=False)
+        self.remote_urls[name] = url
+        self.output.append(f"{BOLD_GREEN}  ✅ added remote {name!r}{RESET}")
 
     def update_remote(self, name: str, old_url: str, new_url: str):
-        print(f"  ⌛ updating remote {self.name!r}")
+        self.output.append(f"  ⌛ updating remote {self.name!r}")
         util.run_command(
-            ["git", "-C", str(self.dir), "remote", "set-url", name, new_url]
+            [*self.git, "remote", "set-url", name, new_url],
+            capture=False,
         )
-        rprint(f"[bold green]  ✅ updated remote {name!r}[/bold green]")
-        rprint(f"[italic green]     from {old_url}[/italic green]")
-        rprint(f"[italic green]     to   {new_url}[/italic green]")
+        self.remote_urls[name] = new_url
+        self.output.append(f"{BOLD_GREEN}  ✅ updated remote {name!r}{RESET}")
+        self.output.append(f"{ITALIC_GREEN}     from {old_url}{RESET}")
+        self.output.append(f"{ITALIC_GREEN}     to   {new_url}{RESET}")
+
+    def clone(self):
+        util.create_parent_dir(self.dir)
+        self.clone_repo()
 
     def clone_repo(self):
-        print(f"  ⌛ cloning {self.name!r}")
+        self.output.append(f"  ⌛ cloning {self.name!r}")
         url = self.remotes.get("origin")
-        util.run_command(["git", "clone", url, str(self.dir)])
-        rprint(f"[bold green]  ✅ cloned {self.name!r}[/bold green]")
-
-    def get_remote_url(self, remote: str) -> str | None:
-        try:
-            return util.run_command(
-                ["git", "-C", str(self.dir), "remote", "get-url", remote],
-                raise_err=True,
-            )
-        # remote doesn't exist
-        except subprocess.CalledProcessError:
-            return None
+        # submodules are set up afterwards, with --jobs, by setup_origin
+        command = ["git", "clone"]
+        if self.partial:
+            # fetch blobs lazily, on checkout
+            command.append("--filter=blob:none")
+        if self.depth:
+            command.extend([f"--depth={self.depth}", "--single-branch"])
+        command.extend([url, str(self.dir)])
+        util.run_command(command, capture=False)
+        self.just_cloned = True
+        self.output.append(f"{BOLD_GREEN}  ✅ cloned {self.name!r}{RESET}")
 
     def init_repo(self):
-        print(f"  ⌛ initializing {self.name!r}")
-        util.run_command(["git", "init", str(self.dir)])
-        rprint(f"[bold green]  ✅ initialized {self.name!r}[/bold green]")
+        self.output.append(f"  ⌛ initializing {self.name!r}")
+        # initialize and add every remote in one shell instead of a call per step
+        commands = [["git", "init", str(self.dir)]]
+        commands.extend(
+            [*self.git, "remote", "add", name, url]
+            for name, url in self.remotes.items()
+        )
+        util.run_shell(commands, capture=False)
+        self.remote_urls = dict(self.remotes)
+        self.output.append(f"{BOLD_GREEN}  ✅ initialized {self.name!r}{RESET}")
+        for name in self.remotes:
+            self.output.append(f"{BOLD_GREEN}  ✅ added remote {name!r}{RESET}")
@@ -1,25 +1,33 @@
+import concurrent.futures
 import datetime
 import difflib
 import logging
 import os
 import pathlib
 import shutil
+import tomllib
+from collections.abc import Iterator, MutableMapping
 from typing import Any
 
 import tomlkit
 from rich import print as rprint
 
 from . import envrc, util
+from .errors import LRMError
 
 logger = logging.getLogger(__name__)
 
+DIFF_CONTEXT = 3
+# clone options that can't be detected from a repo, so update keeps them as-is
+CLONE_KEYS = ("partial", "depth")
+
 
 def get_project_info(
     project_dir: pathlib.Path, group_dir: pathlib.Path
 ) -> tuple[str, dict[str, Any] | None]:
     project = dict()
     config_name = f"{group_dir.name}.{project_dir.name}"
-    remotes = get_remotes(project_dir)
+    remotes = util.list_remotes(project_dir)
     if remotes:
         project["remotes"] = remotes
     else:
@@ -34,69 +42,96 @@ def get_project_info(
     return config_name, project
 
 
-def get_remotes(directory: pathlib.Path) -> dict[str, str]:
-    remote_names = util.run_command(
-        ["git", "-C", str(directory), "remote"]
-    ).splitlines()
-    remotes = dict()
-    for remote in remote_names:
-        remote_url = util.run_command(
-            ["git", "-C", str(directory), "remote", "get-url", remote]
-        )
-        remotes[remote] = remote_url
-    return remotes
+def scan_repo_dir(
+    repo_dir: pathlib.Path,
+) -> Iterator[tuple[os.DirEntry, os.DirEntry]]:
+    """Yield (group, project) entries, using scandir's cached file types."""
+    with os.scandir(repo_dir) as group_dirs:
+        for group_dir in group_dirs:
+            if not group_dir.is_dir():
+                continue
+            logger.debug("looking for projects in %r", group_dir.path)
+            with os.scandir(group_dir) as project_dirs:
+                for project_dir in project_dirs:
+                    yield group_dir, project_dir
 
 
-def update_config(config: tomlkit.TOMLDocument | None, repo_dir: pathlib.Path):
+def update_config(
+    config: MutableMapping[str, Any] | None, repo_dir: pathlib.Path, jobs: int = 1
+):
     """Look for existing git repos, check their remotes, update the dict, and print it as toml."""
     if not config:
-        config = tomlkit.document()
-        config["project"] = tomlkit.table()
+        config = {}
+    config.setdefault("project", {})
 
     if not repo_dir.is_dir():
-        rprint(f"[bold red]  ❌ repo directory {repo_dir} does not exist[/bold red]")
-        exit(os.EX_NOINPUT)
-    for group_dir in repo_dir.iterdir():
-        logger.debug("looking for projects in %r", str(group_dir))
-        for project_dir in group_dir.iterdir():
-            if util.is_inited(project_dir):
-                logger.debug("  found project %r", str(project_dir))
-                rprint(
-                    f"[bold green]  ✅ found '{group_dir.name}/{project_dir.name}'[/bold green]"
-                )
-                name, project = get_project_info(project_dir, group_dir)
-                if project:
-                    config["project"][name] = project
-            else:
-                rprint(
-                    f"[bold yellow]  ❓ no valid git repo found in {group_dir.name}/{project_dir.name}[/bold yellow]"
+        raise LRMError(os.EX_NOINPUT, f"repo directory {repo_dir} does not exist")
+    found_dirs = []
+    for group_dir, project_dir in scan_repo_dir(repo_dir):
+        if util.is_inited(project_dir):
+            logger.debug("  found project %r", project_dir.path)
+            rprint(
+                f"[bold green]  ✅ found '{group_dir.name}/{project_dir.name}'[/bold green]"
+            )
+            found_dirs.append((pathlib.Path(project_dir), pathlib.Path(group_dir)))
+        else:
+            rprint(
+                f"[bold yellow]  ❓ no valid git repo found in {group_dir.name}/{project_dir.name}[/bold yellow]"
+            )
+
+    # inspect the repos in parallel, but update the config from this thread only
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for name, project in executor.map(
+            lambda dirs: get_project_info(*dirs), found_dirs
+        ):
+            if project:
+                existing = config["project"].get(name, {})
+                project.update(
+                    (key, existing[key]) for key in CLONE_KEYS if key in existing
                 )
+                config["project"][name] = project
 
     return config
 
 
-def write_config_file(config: tomlkit.TOMLDocument, config_path: pathlib.Path):
+def write_config_file(config: MutableMapping[str, Any], config_path: pathlib.Path):
     # get filepath friendly timestamp (to the minute)
     if not config_path.parent.exists():
         logger.debug("  creating config directory %r", str(config_path.parent))
         config_path.parent.mkdir(parents=True, exist_ok=True)
 
+    new_text = tomlkit.dumps(config)
+    # write through symlinks, like dotfiles managed by stow, to the real file
+    target_path = pathlib.Path(os.path.realpath(config_path))
     if config_path.exists():
-        # check if changes were made
-        existing_config = tomlkit.parse(config_path.read_text())
-        if config == existing_config:
+        # check if changes were made, only parsing the existing file if it is
+        # formatted differently
+        existing_text = config_path.read_text()
+        if new_text == existing_text or config == tomllib.loads(existing_text):
             rprint("[bold green]✅ no changes to config[/bold green]")
             return
 
         timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H-%M")
         backup_path = config_path.parent / f".{config_path.name}.{timestamp}.bak"
-        shutil.copy(config_path, backup_path)
+        # the config is replaced rather than written in place, so a hard link
+        # keeps the old contents
+        util.link_file(target_path, backup_path)
         rprint(f"[bold green]  ✅ backed up config to {backup_path}[/bold green]")
     else:
         logger.debug("  no existing config file found, skipping backup")
         backup_path = None
 
-    config_path.write_text(tomlkit.dumps(config))
+    # write to a temp file and rename it over the config, so a failed write
+    # can't leave a truncated config behind
+    tmp_path = target_path.with_suffix(target_path.suffix + ".tmp")
+    try:
+        tmp_path.write_text(new_text)
+        if backup_path:
+            shutil.copymode(target_path, tmp_path)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
     rprint(f"[bold green]  ✅ updated config file {config_path}[/bold green]")
 
     if backup_path:
@@ -104,13 +139,52 @@ def write_config_file(config: tomlkit.TOMLDocument, config_path: pathlib.Path):
 
 
 def print_diff(new: pathlib.Path, old: pathlib.Path):
-    new_lines = new.read_text().splitlines()
-    old_lines = old.read_text().splitlines()
-    diff = difflib.unified_diff(
-        old_lines, new_lines, fromfile=str(old), tofile=str(new), lineterm=""
-    )
-    if diff:
-        for line in diff:
-            print(line)
-    else:
+    new_content = new.read_bytes()
+    old_content = old.read_bytes()
+    # skip decoding and diffing when the files are identical
+    if new_content == old_content:
         rprint("[bold green]  ✅ no changes to config[/bold green]")
+        return
+
+    new_lines = new_content.decode().splitlines()
+    old_lines = old_content.decode().splitlines()
+    for line in unified_diff(old_lines, new_lines, str(old), str(new)):
+        print(line)
+
+
+def unified_diff(
+    old_lines: list[str], new_lines: list[str], fromfile: str, tofile: str
+) -> Iterator[str]:
+    """Like difflib.unified_diff, but in linear time when lines were only inserted."""
+    prefix = next(
+        (i for i, (a, b) in enumerate(zip(old_lines, new_lines)) if a != b),
+        min(len(old_lines), len(new_lines)),
+    )
+    inserted = len(new_lines) - len(old_lines)
+    if inserted <= 0 or new_lines[prefix + inserted :] != old_lines[prefix:]:
+        yield from difflib.unified_diff(
+            old_lines, new_lines, fromfile=fromfile, tofile=tofile, lineterm=""
+        )
+        return
+
+    # a single hunk with the inserted lines and up to 3 lines of context
+    start = max(prefix - DIFF_CONTEXT, 0)
+    stop = min(prefix + DIFF_CONTEXT, len(old_lines))
+    yield f"--- {fromfile}"
+    yield f"+++ {tofile}"
+    yield (
+        f"@@ -{_format_range(start, stop)} +{_format_range(start, stop + inserted)} @@"
+    )
+    yield from (f" {line}" for line in old_lines[start:prefix])
+    yield from (f"+{line}" for line in new_lines[prefix : prefix + inserted])
+    yield from (f" {line}" for line in old_lines[prefix:stop])
+
+
+def _format_range(start: int, stop: int) -> str:
+    """Format a hunk range the way difflib.unified_diff does."""
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    if not length:
+        return f"{start},0"
+    return f"{start + 1},{length}"
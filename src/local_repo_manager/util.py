@@ -1,33 +1,124 @@
+import contextlib
 import logging
 import os
 import pathlib
+import shlex
+import shutil
 import subprocess
+import threading
+
+from .errors import LRMError
 
 logger = logging.getLogger(__name__)
 
+CACHE_DIR = pathlib.Path.home() / ".cache/local-repo-manager"
+
+_path_locks: dict[str, threading.Lock] = {}
+_path_locks_guard = threading.Lock()
+
 
 def run_command(
-    command: list[str], raise_err: bool = False, cwd: pathlib.Path | None = None
+    command: list[str],
+    cwd: pathlib.Path | None = None,
+    capture: bool = True,
 ):
     logger.debug("Running command: %s", " ".join(command))
+    # stderr is only read by the debug log, and with a single pipe
+    # communicate() can read it without a selector loop
+    keep_stderr = logger.isEnabledFor(logging.DEBUG)
     try:
         result = subprocess.run(
-            command, check=True, text=True, capture_output=True, cwd=cwd
-        ).stdout.strip()
-        logger.debug("Command output: %s", result)
-        return result
+            command,
+            check=True,
+            stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+            stderr=subprocess.PIPE if keep_stderr else subprocess.DEVNULL,
+            cwd=cwd,
+        )
     except subprocess.CalledProcessError as e:
         logger.debug("Error running command:")
         logger.debug("  return code: %s", e.returncode)
-        logger.debug("  stdout: %s", e.stdout)
-        logger.debug("  stderr: %s", e.stderr)
-        if raise_err:
-            raise e
-        exit(os.EX_OSERR)
+        logger.debug("  stdout: %s", _decode(e.stdout))
+        logger.debug("  stderr: %s", _decode(e.stderr))
+        raise LRMError(os.EX_OSERR, f"command failed: {' '.join(command)}") from e
+
+    if not capture:
+        return None
+    # decode once, after the process has exited
+    output = result.stdout.decode().strip()
+    logger.debug("Command output: %s", output)
+    return output
+
+
+def _decode(output: bytes | None) -> str | None:
+    return output.decode(errors="replace") if output is not None else None
+
+
+def run_shell(
+    commands: list[list[str]],
+    cwd: pathlib.Path | None = None,
+    capture: bool = True,
+):
+    """Run commands in a single shell, stopping at the first one that fails."""
+    return run_command(
+        ["sh", "-c", " && ".join(shlex.join(command) for command in commands)],
+        cwd=cwd,
+        capture=capture,
+    )
 
 
-def is_inited(directory: pathlib.Path) -> bool:
-    return (directory / ".git").is_dir()
+def list_remotes(directory: pathlib.Path) -> dict[str, str]:
+    """Map each remote name of a repo to its url, with one git call."""
+    output = run_command(["git", "-C", str(directory), "remote", "-v"])
+    remotes = {}
+    # lines look like "<name>\t<url> (fetch)", with urls rewritten by insteadOf
+    # like 'git remote get-url', and only the first url of each remote listed
+    for line in output.splitlines():
+        name, _, rest = line.partition("\t")
+        url, _, kind = rest.rpartition(" ")
+        if kind.startswith("[") and kind.endswith("]"):
+            # partial clones add their filter, like "(fetch) [blob:none]"
+            url, _, kind = url.rpartition(" ")
+        if kind == "(fetch)":
+            remotes.setdefault(name, url)
+    return remotes
+
+
+def is_inited(directory: pathlib.Path | os.DirEntry) -> bool:
+    return os.path.isdir(os.path.join(directory, ".git"))
+
+
+def copy_file(source: pathlib.Path, destination: pathlib.Path) -> None:
+    """Copy a file's contents in the kernel, without copying its permissions."""
+    if hasattr(os, "copy_file_range"):
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            remaining = os.fstat(src.fileno()).st_size
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+                return
+            # not supported by this kernel or filesystem
+            except OSError as e:
+                logger.debug("  copy_file_range failed: %s", e)
+    shutil.copyfile(source, destination)
+
+
+def link_file(source: pathlib.Path, destination: pathlib.Path) -> None:
+    """Hard link a file, falling back to a copy across filesystems."""
+    try:
+        try:
+            os.link(source, destination)
+        except FileExistsError:
+            # the old file may be a link to the source itself, so it must be
+            # replaced, never written through
+            logger.debug("  replacing existing file %r", str(destination))
+            os.unlink(destination)
+            os.link(source, destination)
+    except OSError as e:
+        logger.debug("  hard link failed: %s", e)
+        copy_file(source, destination)
 
 
 def create_parent_dir(directory: pathlib.Path):
@@ -38,3 +129,12 @@ def create_parent_dir(directory: pathlib.Path):
 
 def dir_exists(directory: pathlib.Path) -> bool:
     return directory.is_dir()
+
+
+@contextlib.contextmanager
+def path_lock(path: pathlib.Path):
+    """Hold a per-path lock shared by all threads in this process."""
+    with _path_locks_guard:
+        lock = _path_locks.setdefault(str(path), threading.Lock())
+    with lock:
+        yield